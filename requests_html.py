@@ -1,37 +1,44 @@
+import os
+import re
 import sys
 import asyncio
+import base64
+import threading
 from urllib.parse import urlparse, urlunparse, urljoin
 from concurrent.futures import ThreadPoolExecutor
 from concurrent.futures._base import TimeoutError
-from functools import partial
-from typing import Set, Union, List, MutableMapping, Optional
+from functools import partial, lru_cache
+from typing import Set, Union, List, MutableMapping, Optional, Iterator
 
-import pyppeteer
 import requests
+from requests.adapters import HTTPAdapter
 import http.cookiejar
 from pyquery import PyQuery
+from pyquery.cssselectpatch import JQueryTranslator
+from pyquery.text import extract_text
 
 from fake_useragent import UserAgent
 from lxml.html.clean import Cleaner
 import lxml
 from lxml import etree
 from lxml.html import HtmlElement
-from lxml.html import tostring as lxml_html_tostring
-from lxml.html.soupparser import fromstring as soup_parse
-from parse import search as parse_search
-from parse import findall, Result
+from lxml.cssselect import CSSSelector
+from parse import compile as parse_compile
+from parse import Result
 from w3lib.encoding import html_to_unicode
 
 DEFAULT_ENCODING = 'utf-8'
 DEFAULT_URL = 'https://example.org/'
 DEFAULT_USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) AppleWebKit/603.3.8 (KHTML, like Gecko) Version/10.1.2 Safari/603.3.8'
 DEFAULT_NEXT_SYMBOL = ['next', 'more', 'older']
+DEFAULT_MAX_CONCURRENT_RENDERS = 4
 
 cleaner = Cleaner()
 cleaner.javascript = True
 cleaner.style = True
 
 useragent = None
+useragent_lock = threading.Lock()
 
 # Typing.
 _Find = Union[List['Element'], 'Element']
@@ -77,6 +84,12 @@ class BaseParser:
 
     """
 
+    __slots__ = [
+        'element', 'url', 'skip_anchors', 'default_encoding', '_encoding',
+        '_html', '_unicode_html', '_lxml', '_pq', '_base_url',
+        '_links', '_absolute_links'
+    ]
+
     def __init__(self, *, element, default_encoding: _DefaultEncoding = None, html: _HTML = None, url: _URL) -> None:
         self.element = element
         self.url = url
@@ -84,8 +97,12 @@ class BaseParser:
         self.default_encoding = default_encoding
         self._encoding = None
         self._html = html.encode(DEFAULT_ENCODING) if isinstance(html, str) else html
+        self._unicode_html = None
         self._lxml = None
         self._pq = None
+        self._base_url = None
+        self._links = None
+        self._absolute_links = None
 
     @property
     def raw_html(self) -> _RawHTML:
@@ -95,26 +112,38 @@ class BaseParser:
         if self._html:
             return self._html
         else:
-            return etree.tostring(self.element, encoding='unicode').strip().encode(self.encoding)
+            return self.html.encode(self.encoding)
 
     @property
     def html(self) -> _BaseHTML:
         """Unicode representation of the HTML content
         (`learn more <http://www.diveintopython3.net/strings.html>`_).
         """
-        if self._html:
-            return self.raw_html.decode(self.encoding, errors='replace')
-        else:
-            return etree.tostring(self.element, encoding='unicode').strip()
+        # Decoding or serializing is O(document size), so only do it once.
+        if self._unicode_html is None:
+            if self._html:
+                self._unicode_html = self._html.decode(self.encoding, errors='replace')
+            else:
+                self._unicode_html = etree.tostring(self.element, encoding='unicode').strip()
+
+        return self._unicode_html
 
     @html.setter
     def html(self, html: str) -> None:
         self._html = html.encode(self.encoding)
+        self._unicode_html = html
+        self._base_url = None
+        self._links = None
+        self._absolute_links = None
 
     @raw_html.setter
     def raw_html(self, html: bytes) -> None:
         """Property setter for self.html."""
         self._html = html
+        self._unicode_html = None
+        self._base_url = None
+        self._links = None
+        self._absolute_links = None
 
     @property
     def encoding(self) -> _Encoding:
@@ -126,13 +155,7 @@ class BaseParser:
 
         # Scan meta tags for charset.
         if self._html:
-            self._encoding = html_to_unicode(self.default_encoding, self._html)[0]
-            # Fall back to requests' detected encoding if decode fails.
-            try:
-                self.raw_html.decode(self.encoding, errors='replace')
-            except UnicodeDecodeError:
-                self._encoding = self.default_encoding
-
+            self._encoding = _detect_encoding(self.default_encoding, self._html[:_ENCODING_SCAN_BYTES])
 
         return self._encoding if self._encoding else self.default_encoding
 
@@ -140,6 +163,7 @@ class BaseParser:
     def encoding(self, enc: str) -> None:
         """Property setter for self.encoding."""
         self._encoding = enc
+        self._unicode_html = None
 
     @property
     def pq(self) -> PyQuery:
@@ -157,19 +181,52 @@ class BaseParser:
         :class:`Element <Element>` or :class:`HTML <HTML>`.
         """
         if self._lxml is None:
-            try:
-                self._lxml = soup_parse(self.html, features='html.parser')
-            except ValueError:
-                self._lxml = lxml.html.fromstring(self.raw_html)
+            self._lxml = self._parse()
 
         return self._lxml
 
+    def _parse(self, cached: bool = False) -> HtmlElement:
+        """Parses the HTML content into an lxml tree.
+
+        :param cached: Whether to go through the parse cache
+            (see :func:`clear_parse_cache`).
+        """
+        html_root = _cached_html_root if cached else _html_root
+
+        # lxml's C parser, reading the bytes directly, with BeautifulSoup
+        # only as a fallback for markup it can't handle.
+        try:
+            if self._html is None:
+                # An Element: parse its own markup, without the text that
+                # follows it in the document (its tail).
+                root = html_root(etree.tostring(self.element, encoding='unicode', with_tail=False))
+            else:
+                try:
+                    parser = _html_parser(self.encoding)
+                except LookupError:
+                    # An encoding libxml2 doesn't know: parse the decoded text.
+                    root = html_root(self.html)
+                else:
+                    root = html_root(self.raw_html, parser)
+        except (etree.ParserError, etree.XMLSyntaxError, ValueError):
+            # Imported here, as it pulls in BeautifulSoup for a rare fallback.
+            from lxml.html.soupparser import fromstring as soup_parse
+            return soup_parse(self.html, features='html.parser')
+
+        return root
+
     @property
     def text(self) -> _Text:
         """The text content of the
         :class:`Element <Element>` or :class:`HTML <HTML>`.
         """
-        return self.pq.text()
+        root = self.lxml
+        if root.tag == 'textarea':
+            # PyQuery returns a textarea's inner HTML as-is.
+            return self.pq.text()
+
+        # What PyQuery.text() runs, without building a PyQuery object first.
+        return extract_text(root)
 
     @property
     def full_text(self) -> _Text:
@@ -178,11 +235,18 @@ class BaseParser:
         """
         return self.lxml.text_content()
 
-    def find(self, selector: str = "*", *, containing: _Containing = None, clean: bool = False, first: bool = False, _encoding: str = None) -> _Find:
+    def _select(self, selector: Union[str, CSSSelector]) -> List[HtmlElement]:
+        """Runs a CSS Selector directly against :attr:`lxml`, returning
+        the matching lxml elements without building a PyQuery object.
+        """
+        return _as_css_selector(selector)(self.lxml)
+
+    def find(self, selector: Union[str, CSSSelector] = "*", *, containing: _Containing = None, clean: bool = False, first: bool = False, _encoding: str = None) -> _Find:
         """Given a CSS Selector, returns a list of
         :class:`Element <Element>` objects or a single one.
 
-        :param selector: CSS Selector to use.
+        :param selector: CSS Selector to use, as a string or an already
+            compiled :class:`lxml.cssselect.CSSSelector`.
         :param clean: Whether or not to sanitize the found HTML of ``<script>`` and ``<style>`` tags.
         :param containing: If specified, only return elements that contain the provided text.
         :param first: Whether or not to return just the first result.
@@ -207,38 +271,33 @@ class BaseParser:
         if isinstance(containing, str):
             containing = [containing]
 
+        if containing:
+            # Let libxml2 do the text matching, rather than a Python loop.
+            needles = _needles(containing)
+            selected = _css_containing_xpath(selector, len(needles))(self.lxml, **needles)
+            selected.reverse()
+        else:
+            selected = self._select(selector)
+
         encoding = _encoding or self.encoding
         elements = [
             Element(element=found, url=self.url, default_encoding=encoding)
-            for found in self.pq(selector)
+            for found in selected
         ]
 
-        if containing:
-            elements_copy = elements.copy()
-            elements = []
-
-            for element in elements_copy:
-                if any([c.lower() in element.full_text.lower() for c in containing]):
-                    elements.append(element)
-
-            elements.reverse()
-
         # Sanitize the found HTML.
         if clean:
-            elements_copy = elements.copy()
-            elements = []
-
-            for element in elements_copy:
-                element.raw_html = lxml_html_tostring(cleaner.clean_html(element.lxml))
-                elements.append(element)
+            for element in elements:
+                element._clean()
 
         return _get_first_or_list(elements, first)
 
-    def xpath(self, selector: str, *, clean: bool = False, first: bool = False, _encoding: str = None) -> _XPath:
+    def xpath(self, selector: Union[str, etree.XPath], *, clean: bool = False, first: bool = False, _encoding: str = None) -> _XPath:
         """Given an XPath selector, returns a list of
         :class:`Element <Element>` objects or a single one.
 
-        :param selector: XPath Selector to use.
+        :param selector: XPath Selector to use, as a string or an already
+            compiled :class:`lxml.etree.XPath`.
         :param clean: Whether or not to sanitize the found HTML of ``<script>`` and ``<style>`` tags.
         :param first: Whether or not to return just the first result.
         :param _encoding: The encoding format.
@@ -253,22 +312,22 @@ class BaseParser:
         If ``first`` is ``True``, only returns the first
         :class:`Element <Element>` found.
         """
-        selected = self.lxml.xpath(selector)
+        if not isinstance(selector, etree.XPath):
+            selector = _compile_xpath(selector)
+        selected = selector(self.lxml)
 
+        encoding = _encoding or self.encoding
         elements = [
-            Element(element=selection, url=self.url, default_encoding=_encoding or self.encoding)
-            if not isinstance(selection, etree._ElementUnicodeResult) else str(selection)
+            Element(element=selection, url=self.url, default_encoding=encoding)
+            if not isinstance(selection, str) else str(selection)
             for selection in selected
         ]
 
         # Sanitize the found HTML.
         if clean:
-            elements_copy = elements.copy()
-            elements = []
-
-            for element in elements_copy:
-                element.raw_html = lxml_html_tostring(cleaner.clean_html(element.lxml))
-                elements.append(element)
+            for element in elements:
+                if isinstance(element, Element):
+                    element._clean()
 
         return _get_first_or_list(elements, first)
 
@@ -278,7 +337,7 @@ class BaseParser:
         :param template: The Parse template to use.
         """
 
-        return parse_search(template, self.html)
+        return _compile_template(template).search(self.html)
 
     def search_all(self, template: str) -> _Result:
         """Search the :class:`Element <Element>` (multiple times) for the given parse
@@ -286,41 +345,42 @@ class BaseParser:
 
         :param template: The Parse template to use.
         """
-        return [r for r in findall(template, self.html)]
+        return [r for r in _compile_template(template).findall(self.html)]
 
     @property
     def links(self) -> _Links:
         """All found links on page, in as–is form."""
 
-        def gen():
-            for link in self.find('a'):
+        # The hrefs only change with the document, so keep the result for
+        # the current skip_anchors setting, and hand out copies of it.
+        if self._links is None or self._links[0] != self.skip_anchors:
+            skipped = (_SKIPPED_HREF_OR_ANCHOR if self.skip_anchors else _SKIPPED_HREF).match
+            links = frozenset(href for href in self._iter_hrefs() if href and not skipped(href))
+            self._links = (self.skip_anchors, links)
 
-                try:
-                    href = link.attrs['href'].strip()
-                    if href and not (href.startswith('#') and self.skip_anchors) and not href.startswith(('javascript:', 'mailto:')):
-                        yield href
-                except KeyError:
-                    pass
+        return set(self._links[1])
 
-        return set(gen())
+    def _iter_hrefs(self) -> Iterator[str]:
+        """Yields the stripped ``href`` of every ``<a>`` element, read
+        straight from the attribute nodes.
+        """
+        for href in _HREF_XPATH(self.lxml):
+            yield href.strip()
 
     def _make_absolute(self, link):
         """Makes a given link absolute."""
 
         # Parse the link with stdlib.
-        parsed = urlparse(link)._asdict()
+        parsed = urlparse(link)
 
         # If link is relative, then join it with base_url.
-        if not parsed['netloc']:
+        if not parsed.netloc:
             return urljoin(self.base_url, link)
 
         # Link is absolute; if it lacks a scheme, add one from base_url.
-        if not parsed['scheme']:
-            parsed['scheme'] = urlparse(self.base_url).scheme
-
+        if not parsed.scheme:
             # Reconstruct the URL to incorporate the new scheme.
-            parsed = (v for v in parsed.values())
-            return urlunparse(parsed)
+            return urlunparse(parsed._replace(scheme=urlparse(self.base_url).scheme))
 
         # Link is absolute and complete with scheme; nothing to be done here.
         return link
@@ -332,21 +392,31 @@ class BaseParser:
         (`learn more <https://www.navegabem.com/absolute-or-relative-links.html>`_).
         """
 
-        def gen():
-            for link in self.links:
-                yield self._make_absolute(link)
+        key = (self.skip_anchors, self.url)
+        if self._absolute_links is None or self._absolute_links[0] != key:
+            self._absolute_links = (key, frozenset(self._make_absolute(link) for link in self.links))
 
-        return set(gen())
+        return set(self._absolute_links[1])
 
     @property
     def base_url(self) -> _URL:
         """The base URL for the page. Supports the ``<base>`` tag
         (`learn more <https://www.w3schools.com/tags/tag_base.asp>`_)."""
 
+        # Looking up <base> walks the whole tree, and absolute_links needs
+        # the base URL for every link, so remember it for the current URL.
+        if self._base_url is None or self._base_url[0] != self.url:
+            self._base_url = (self.url, self._find_base_url())
+
+        return self._base_url[1]
+
+    def _find_base_url(self) -> _URL:
+        """Works out :attr:`base_url`, from the ``<base>`` tag or the URL."""
+
         # Support for <base> tag.
-        base = self.find('base', first=True)
+        base = self._select('base')
         if base:
-            result = base.attrs.get('href', '').strip()
+            result = base[0].get('href', '').strip()
             if result:
                 return result
 
@@ -371,10 +441,7 @@ class Element(BaseParser):
     :param default_encoding: Which encoding to default to.
     """
 
-    __slots__ = [
-        'element', 'url', 'skip_anchors', 'default_encoding', '_encoding',
-        '_html', '_lxml', '_pq', '_attrs', 'session'
-    ]
+    __slots__ = ['tag', 'lineno', '_attrs']
 
     def __init__(self, *, element, url: _URL, default_encoding: _DefaultEncoding = None) -> None:
         super(Element, self).__init__(element=element, url=url, default_encoding=default_encoding)
@@ -383,8 +450,21 @@ class Element(BaseParser):
         self.lineno = element.sourceline
         self._attrs = None
 
+    def _clean(self) -> None:
+        """Sanitizes the element of ``<script>`` and ``<style>`` tags. Its
+        HTML and text are read from the cleaned copy, while ``element`` (and
+        so ``attrs``) stays the original one, in its place in the document.
+        """
+        cleaned = cleaner.clean_html(self.element)
+        self._lxml = cleaned
+        self._html = None
+        self._unicode_html = etree.tostring(cleaned, encoding='unicode').strip()
+        self._pq = None
+        self._links = None
+        self._absolute_links = None
+
     def __repr__(self) -> str:
-        attrs = ['{}={}'.format(attr, repr(self.attrs[attr])) for attr in self.attrs]
+        attrs = ['{}={}'.format(attr, repr(value)) for attr, value in self.attrs.items()]
         return "<Element {} {}>".format(repr(self.element.tag), ' '.join(attrs))
 
     @property
@@ -393,7 +473,8 @@ class Element(BaseParser):
         (`learn more <https://www.w3schools.com/tags/ref_attributes.asp>`_).
         """
         if self._attrs is None:
-            self._attrs = {k: v for k, v in self.element.items()}
+            # Copied from lxml in a single pass.
+            self._attrs = dict(self.element.attrib)
 
             # Split class and rel up, as there are usually many of them:
             for attr in ['class', 'rel']:
@@ -409,24 +490,49 @@ class HTML(BaseParser):
     :param url: The URL from which the HTML originated, used for ``absolute_links``.
     :param html: HTML from which to base the parsing upon (optional).
     :param default_encoding: Which encoding to default to.
+    :param parse_cache: If ``True``, reuse the parsed document of identical HTML
+        seen recently (see :func:`clear_parse_cache`). The tree is then shared
+        between :class:`HTML <HTML>` objects, so it must not be modified.
     """
 
-    def __init__(self, *, session: Union['HTMLSession', 'AsyncHTMLSession'] = None, url: str = DEFAULT_URL, html: _HTML, default_encoding: str = DEFAULT_ENCODING, async_: bool = False) -> None:
+    __slots__ = ['page', 'next_symbol', 'browser', '_session', '_async', '_next_links']
+
+    def __init__(self, *, session: Union['HTMLSession', 'AsyncHTMLSession'] = None, url: str = DEFAULT_URL, html: _HTML, default_encoding: str = DEFAULT_ENCODING, async_: bool = False, parse_cache: bool = False) -> None:
 
         # Convert incoming unicode HTML into bytes.
         if isinstance(html, str):
             html = html.encode(DEFAULT_ENCODING)
 
-        pq = PyQuery(html)
         super(HTML, self).__init__(
-            element=pq('html') or pq.wrapAll('<html></html>')('html'),
+            element=None,
             html=html,
             url=url,
             default_encoding=default_encoding
         )
-        self.session = session or async_ and AsyncHTMLSession() or HTMLSession()
+        # Parse the document once, and share that tree with lxml and pq.
+        self._lxml = self._parse(cached=parse_cache)
+        self.element = self._pq = PyQuery(self._lxml)
+        # Building a session is as costly as parsing a small document, and
+        # most HTML objects never fetch or render, so only do it when needed.
+        self._session = session
+        self._async = async_
         self.page = None
         self.next_symbol = DEFAULT_NEXT_SYMBOL
+        self._next_links = {}
+
+    @property
+    def session(self) -> Union['HTMLSession', 'AsyncHTMLSession']:
+        """The session used to fetch further pages and to render, created
+        on first use if none was given.
+        """
+        if self._session is None:
+            self._session = AsyncHTMLSession() if self._async else HTMLSession()
+
+        return self._session
+
+    @session.setter
+    def session(self, session: Union['HTMLSession', 'AsyncHTMLSession']) -> None:
+        self._session = session
 
     def __repr__(self) -> str:
         return f"<HTML url={self.url!r}>"
@@ -441,29 +547,22 @@ class HTML(BaseParser):
             next_symbol = DEFAULT_NEXT_SYMBOL
 
         def get_next():
-            candidates = self.find('a', containing=next_symbol)
-
-            for candidate in candidates:
-                if candidate.attrs.get('href'):
-                    # Support 'next' rel (e.g. reddit).
-                    if 'next' in candidate.attrs.get('rel', []):
-                        return candidate.attrs['href']
+            # Among the links containing any of the symbols, the last one that
+            # looks like a next link, else the first one; all done by lxml.
+            symbols = _needles(next_symbol)
+            for ranked in (True, False):
+                hrefs = _next_link_xpath(len(symbols), ranked)(self.lxml, **symbols)
+                if hrefs:
+                    return hrefs[0]
 
-                    # Support 'next' in classnames.
-                    for _class in candidate.attrs.get('class', []):
-                        if 'next' in _class:
-                            return candidate.attrs['href']
-
-                    if 'page' in candidate.attrs['href']:
-                        return candidate.attrs['href']
+            return None
 
-            try:
-                # Resort to the last candidate.
-                return candidates[-1].attrs['href']
-            except IndexError:
-                return None
+        # Pages don't change between iterations, so only scan them once.
+        key = tuple(next_symbol)
+        if key not in self._next_links:
+            self._next_links[key] = get_next()
 
-        __next = get_next()
+        __next = self._next_links[key]
         if __next:
             url = self._make_absolute(__next)
         else:
@@ -499,11 +598,43 @@ class HTML(BaseParser):
             response = await self.session.get(url)
             return response.html
 
+    async def aiter(self):
+        """Asynchronously iterates over this page and the pages following it.
+
+        With an :class:`AsyncHTMLSession <AsyncHTMLSession>`, the next page is
+        requested as soon as its URL is known, so it downloads while the
+        current one is being processed by the loop body. An
+        :class:`HTMLSession <HTMLSession>` is only used from the calling
+        thread, as with ``__iter__``, since the loop body may use it too: the
+        next page is then requested once the body is done with the current one.
+        """
+        # AsyncHTMLSession runs every request on its thread pool anyway.
+        prefetch = isinstance(self.session, AsyncHTMLSession)
+
+        page = self
+        while page is not None:
+            url = page.next(fetch=False, next_symbol=self.next_symbol)
+            upcoming = asyncio.ensure_future(self.session.get(url)) if url and prefetch else None
+            try:
+                yield page
+            except BaseException:
+                if upcoming:
+                    upcoming.cancel()
+                raise
+
+            if upcoming:
+                page = (await upcoming).html
+            elif url:
+                page = self.session.get(url).html
+            else:
+                page = None
+
     def add_next_symbol(self, next_symbol):
         self.next_symbol.append(next_symbol)
 
-    async def _async_render(self, *, url: str, script: str = None, scrolldown, sleep: int, wait: float, reload, content: Optional[str], timeout: Union[float, int], keep_page: bool, cookies: list = [{}]):
+    async def _async_render(self, *, url: str, script: str = None, scrolldown, sleep: int, wait: float, reload, content: Optional[bytes], timeout: Union[float, int], keep_page: bool, cookies: list = [{}]):
         """ Handle page creation and js rendering. Internal use for render/arender methods. """
+        page = None
         try:
             page = await self.browser.newPage()
 
@@ -519,7 +650,9 @@ class HTML(BaseParser):
             if reload:
                 await page.goto(url, options={'timeout': int(timeout * 1000)})
             else:
-                await page.goto(f'data:text/html,{self.html}', options={'timeout': int(timeout * 1000)})
+                # Ship the raw bytes as-is, rather than decoding the document to text.
+                data = base64.b64encode(content).decode('ascii')
+                await page.goto(f'data:text/html;charset={self.encoding};base64,{data}', options={'timeout': int(timeout * 1000)})
 
             result = None
             if script:
@@ -545,6 +678,33 @@ class HTML(BaseParser):
             await page.close()
             page = None
             return None
+        except asyncio.CancelledError:
+            # Another concurrent attempt won the race (see arender).
+            if page:
+                await page.close()
+            raise
+
+    def _rehydrate_from_content(self, content: _HTML) -> None:
+        """Replace the parsed document with freshly rendered content, keeping
+        the session, URL and pagination settings of this object.
+        """
+        self.default_encoding = DEFAULT_ENCODING
+        if isinstance(content, str):
+            # Text from the browser: we know its encoding once encoded, and
+            # already have the decoded form, so skip detecting and decoding.
+            self._html = content.encode(DEFAULT_ENCODING)
+            self._unicode_html = content
+            self._encoding = DEFAULT_ENCODING
+        else:
+            self._html = content
+            self._unicode_html = None
+            self._encoding = None
+        self._base_url = None
+        self._links = None
+        self._absolute_links = None
+        self._next_links = {}
+        self._lxml = self._parse()
+        self.element = self._pq = PyQuery(self._lxml)
 
     def _convert_cookiejar_to_render(self, session_cookiejar):
         """
@@ -649,7 +809,7 @@ class HTML(BaseParser):
         """
 
         self.browser = self.session.browser  # Automatically create a event loop and browser
-        content = None
+        rendered = None
 
         # Automatically set Reload to False, if example URL is being used.
         if self.url == DEFAULT_URL:
@@ -659,28 +819,31 @@ class HTML(BaseParser):
            cookies = self._convert_cookiesjar_to_render()
 
         for i in range(retries):
-            if not content:
-                try:
-
-                    content, result, page = self.session.loop.run_until_complete(self._async_render(url=self.url, script=script, sleep=sleep, wait=wait, content=self.html, reload=reload, scrolldown=scrolldown, timeout=timeout, keep_page=keep_page, cookies=cookies))
-                except TypeError:
-                    pass
-            else:
+            rendered = self.session.loop.run_until_complete(self._async_render(url=self.url, script=script, sleep=sleep, wait=wait, content=self.raw_html, reload=reload, scrolldown=scrolldown, timeout=timeout, keep_page=keep_page, cookies=cookies))
+            # _async_render returns None on a timeout, the one failure worth
+            # retrying; anything else is raised straight away.
+            if rendered:
+                content, result, page = rendered
                 break
 
-        if not content:
+        if not rendered:
             raise MaxRetries("Unable to render the page. Try increasing timeout")
 
-        html = HTML(url=self.url, html=content.encode(DEFAULT_ENCODING), default_encoding=DEFAULT_ENCODING)
-        self.__dict__.update(html.__dict__)
+        self._rehydrate_from_content(content)
         self.page = page
         return result
 
     async def arender(self, retries: int = 8, script: str = None, wait: float = 0.2, scrolldown=False, sleep: int = 0, reload: bool = True, timeout: Union[float, int] = 8.0, keep_page: bool = False, cookies: list = [{}], send_cookies_session: bool = False):
-        """ Async version of render. Takes same parameters. """
+        """ Async version of render. Takes same parameters.
+
+        Pages are loaded one at a time, as with :meth:`render`. Only when an
+        attempt times out, or is still rendering once it should have been
+        done, is another one started next to it; the first one to succeed
+        wins and the others are cancelled. At most
+        ``session.max_concurrent_renders`` pages are rendered at once.
+        """
 
         self.browser = await self.session.browser
-        content = None
 
         # Automatically set Reload to False, if example URL is being used.
         if self.url == DEFAULT_URL:
@@ -689,23 +852,70 @@ class HTML(BaseParser):
         if send_cookies_session:
            cookies = self._convert_cookiesjar_to_render()
 
-        for _ in range(retries):
-            if not content:
-                try:
+        # How long rendering the page should take, at most.
+        budget = wait + timeout + sleep * (scrolldown or 1)
+        overdue = asyncio.Event()
 
-                    content, result, page = await self._async_render(url=self.url, script=script, sleep=sleep, wait=wait, content=self.html, reload=reload, scrolldown=scrolldown, timeout=timeout, keep_page=keep_page, cookies=cookies)
-                except TypeError:
-                    pass
-            else:
-                break
-
-        if not content:
-            raise MaxRetries("Unable to render the page. Try increasing timeout")
-
-        html = HTML(url=self.url, html=content.encode(DEFAULT_ENCODING), default_encoding=DEFAULT_ENCODING)
-        self.__dict__.update(html.__dict__)
-        self.page = page
-        return result
+        async def attempt():
+            async with self.session.render_semaphore:
+                # Time the render itself, not the wait for a free slot.
+                timer = asyncio.get_event_loop().call_later(budget, overdue.set)
+                try:
+                    return await self._async_render(url=self.url, script=script, sleep=sleep, wait=wait, content=self.raw_html, reload=reload, scrolldown=scrolldown, timeout=timeout, keep_page=keep_page, cookies=cookies)
+                finally:
+                    timer.cancel()
+
+        pending = {asyncio.ensure_future(attempt())}
+        watch = asyncio.ensure_future(overdue.wait())
+        attempts = 1
+        rendered = []
+        errors = []
+        kept = None
+        try:
+            while pending and not rendered:
+                await asyncio.wait(pending | {watch}, return_when=asyncio.FIRST_COMPLETED)
+
+                hedge = watch.done()
+                if hedge:
+                    overdue.clear()
+                    watch = asyncio.ensure_future(overdue.wait())
+
+                for task in [task for task in pending if task.done()]:
+                    pending.remove(task)
+                    if task.exception():
+                        errors.append(task.exception())
+                    elif task.result():
+                        rendered.append(task.result())
+                    else:
+                        # _async_render returns None on a timeout.
+                        hedge = True
+
+                # Other errors aren't worth retrying, as in render.
+                if hedge and not rendered and not errors and attempts < retries:
+                    pending.add(asyncio.ensure_future(attempt()))
+                    attempts += 1
+
+            if not rendered:
+                if errors:
+                    raise errors[0]
+                raise MaxRetries("Unable to render the page. Try increasing timeout")
+
+            content, result, page = rendered[0]
+
+            self._rehydrate_from_content(content)
+            self.page = page
+            kept = rendered[0]
+            return result
+        finally:
+            watch.cancel()
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(watch, *pending, return_exceptions=True)
+
+            # Close the pages of the attempts that aren't handed out.
+            for outcome in rendered:
+                if outcome is not kept and outcome[2]:
+                    await outcome[2].close()
 
 
 class HTMLResponse(requests.Response):
@@ -737,10 +947,195 @@ def user_agent(style=None) -> _UserAgent:
     style. Defaults to a Chrome-style User-Agent.
     """
     global useragent
-    if (not useragent) and style:
-        useragent = UserAgent()
+    if not style:
+        return DEFAULT_USER_AGENT
+
+    # UserAgent() loads its whole browser database, so build it only once,
+    # even when several sessions are created from different threads.
+    if useragent is None:
+        with useragent_lock:
+            if useragent is None:
+                useragent = UserAgent()
+
+    return useragent[style]
+
+
+def _html_root(html: _HTML, parser: lxml.html.HTMLParser = None) -> HtmlElement:
+    """Parses ``html`` and returns its ``<html>`` element. Fragments are put
+    straight under it, as BeautifulSoup does, rather than in the ``<head>``
+    and ``<body>`` libxml2 adds around them.
+    """
+    # A single HTML parse; PyQuery(html) would try (and fail) an XML parse first.
+    root = lxml.html.document_fromstring(html, parser=parser)
+    if not _DOCUMENT_TAGS[type(html)].search(html):
+        for implied in root.xpath('head | body'):
+            implied.drop_tag()
+
+    # Done before the parse cache shares the tree, which must not change.
+    _collapse_whitespace(root)
+    return root
+
+
+# Tags which make markup a document, rather than a fragment.
+_DOCUMENT_TAGS = {
+    bytes: re.compile(rb'<(?:html|head|body)[\s/>]', re.IGNORECASE),
+    str: re.compile(r'<(?:html|head|body)[\s/>]', re.IGNORECASE),
+}
+
+_cached_html_root = lru_cache(maxsize=64)(_html_root)
+
+
+def clear_parse_cache() -> None:
+    """Empties the cache of parsed documents used by ``HTML(parse_cache=True)``."""
+    _cached_html_root.cache_clear()
+
+
+# How much of a document w3lib looks at for a BOM or a declared charset.
+_ENCODING_SCAN_BYTES = 4096
+
+
+@lru_cache(maxsize=64)
+def _detect_encoding(default_encoding: str, head: bytes) -> str:
+    """Detects the encoding of a document from its first bytes, as
+    :func:`html_to_unicode <w3lib.encoding.html_to_unicode>` would from the
+    whole of it, without decoding the rest of the document.
+    """
+    return html_to_unicode(default_encoding, head)[0]
+
+
+@lru_cache(maxsize=None)
+def _html_parser(encoding: str) -> lxml.html.HTMLParser:
+    """Returns an lxml HTML parser decoding its input with ``encoding``."""
+    return lxml.html.HTMLParser(encoding=encoding)
+
+
+# Whitespace as BeautifulSoup sees it, and the tags in which it keeps it as-is.
+_ASCII_WHITESPACE = ' \t\n\r\f'
+_PRESERVE_WHITESPACE_TAGS = frozenset(['pre', 'textarea'])
+
+
+def _collapse_whitespace(root: HtmlElement) -> None:
+    """Collapses whitespace-only text into a single newline (or space), as
+    BeautifulSoup does, so a tree parsed by lxml reads the same as one parsed
+    by :func:`soup_parse <lxml.html.soupparser.fromstring>`.
+    """
+    def collapse(text):
+        if text and not text.strip(_ASCII_WHITESPACE):
+            return '\n' if '\n' in text else ' '
+        return text
+
+    # Walked by lxml, which also skips the preserved subtrees for us.
+    walker = etree.iterwalk(root, events=('start', 'comment', 'pi'))
+    for _, element in walker:
+        if element.tag in _PRESERVE_WHITESPACE_TAGS:
+            walker.skip_subtree()
+        elif isinstance(element.tag, str):
+            element.text = collapse(element.text)
+        element.tail = collapse(element.tail)
+
+
+# Translates CSS the same way PyQuery does, jQuery extensions included.
+_css_translator = JQueryTranslator(xhtml=False)
+
+
+@lru_cache(maxsize=256)
+def _css_selector(selector: str) -> CSSSelector:
+    """Compiles a CSS Selector into an lxml :class:`CSSSelector`. Compiled
+    selectors are cached, as the same few (``a``, ``base``, …) are used
+    over and over.
+    """
+    return CSSSelector(selector, translator=_css_translator)
+
+
+def _as_css_selector(selector: Union[str, CSSSelector]) -> CSSSelector:
+    """Returns ``selector`` compiled, leaving already compiled ones as is."""
+    if isinstance(selector, CSSSelector):
+        return selector
+    return _css_selector(selector)
+
+
+# Compiled XPath expressions, for selectors used over and over.
+_compile_xpath = lru_cache(maxsize=512)(etree.XPath)
+
 
-    return useragent[style] if style else DEFAULT_USER_AGENT
+# Compiled Parse templates, for search and search_all.
+_compile_template = lru_cache(maxsize=256)(parse_compile)
+
+
+# The href attributes of all <a> elements, for links.
+_HREF_XPATH = etree.XPath('descendant-or-self::a/@href')
+
+# hrefs left out of links, with and without in-page anchors.
+_SKIPPED_HREF = re.compile('javascript:|mailto:')
+_SKIPPED_HREF_OR_ANCHOR = re.compile('#|javascript:|mailto:')
+
+
+# XPath extension functions, under the ``rh`` prefix.
+_XPATH_NAMESPACES = {'rh': 'https://github.com/psf/requests-html'}
+
+
+def _xpath_lower_case(context, text: str) -> str:
+    """``rh:lower-case()``: XPath 1.0 has no lower-case(), and translate()
+    only knows about A-Z, where ``str.lower()`` folds any letter.
+    """
+    return text.lower()
+
+
+etree.FunctionNamespace(_XPATH_NAMESPACES['rh'])['lower-case'] = _xpath_lower_case
+
+
+# Case-insensitive string value of the context node, for XPath ``contains()``.
+_LOWERCASE_TEXT = 'rh:lower-case(string(.))'
+
+
+def _needles(words: List[str]) -> dict:
+    """Maps ``words`` to the ``$needle0`` … ``$needleN`` XPath variables
+    expected by :func:`_text_contains_any`.
+    """
+    return {f'needle{i}': word.lower() for i, word in enumerate(words)}
+
+
+def _text_contains_any(needles: int) -> str:
+    """Builds an XPath test for a node whose text contains any of the
+    ``$needle0`` … ``$needleN`` variables, ignoring case.
+    """
+    tests = ' or '.join(f'contains({_LOWERCASE_TEXT}, $needle{i})' for i in range(needles))
+    return tests or 'true()'
+
+
+# An <a> that looks like a link to the next page: 'next' in its rel (e.g.
+# reddit) or classnames, or 'page' in its href.
+_NEXT_LINK_RANK = (
+    "@href != '' and ("
+    "contains(concat(' ', normalize-space(@rel), ' '), ' next ')"
+    " or contains(@class, 'next')"
+    " or contains(@href, 'page'))"
+)
+
+
+@lru_cache(maxsize=None)
+def _next_link_xpath(needles: int, ranked: bool) -> etree.XPath:
+    """Compiles an XPath selecting the ``href`` of a candidate next link,
+    among the ``<a>`` elements whose text contains any of the needles.
+
+    :param ranked: If ``True``, the last candidate that looks like a next
+        link (see ``_NEXT_LINK_RANK``); otherwise, the first candidate.
+    """
+    candidates = f'descendant-or-self::a[{_text_contains_any(needles)}]'
+    if ranked:
+        path = f'({candidates}[{_NEXT_LINK_RANK}])[last()]/@href'
+    else:
+        path = f'({candidates})[1]/@href'
+
+    return etree.XPath(path, namespaces=_XPATH_NAMESPACES, smart_strings=False)
+
+
+@lru_cache(maxsize=256)
+def _css_containing_xpath(selector: Union[str, CSSSelector], needles: int) -> etree.XPath:
+    """Compiles a CSS Selector, keeping only the elements whose text
+    contains any of the needles.
+    """
+    return etree.XPath(f'({_as_css_selector(selector).path})[{_text_contains_any(needles)}]', namespaces=_XPATH_NAMESPACES)
 
 
 def _get_first_or_list(l, first=False):
@@ -759,7 +1154,8 @@ class BaseSession(requests.Session):
     """
 
     def __init__(self, mock_browser : bool = True, verify : bool = True,
-                 browser_args : list = ['--no-sandbox']):
+                 browser_args : list = ['--no-sandbox'],
+                 max_concurrent_renders : int = DEFAULT_MAX_CONCURRENT_RENDERS):
         super().__init__()
 
         # Mock a web browser's user agent.
@@ -770,7 +1166,7 @@ class BaseSession(requests.Session):
         self.verify = verify
 
         self.__browser_args = browser_args
-
+        self.max_concurrent_renders = max_concurrent_renders
 
     def response_hook(self, response, **kwargs) -> HTMLResponse:
         """ Change response encoding and replace it by a HTMLResponse. """
@@ -781,10 +1177,21 @@ class BaseSession(requests.Session):
     @property
     async def browser(self):
         if not hasattr(self, "_browser"):
+            # Imported on first use: pyppeteer is slow to import, and only
+            # needed to render.
+            import pyppeteer
             self._browser = await pyppeteer.launch(ignoreHTTPSErrors=not(self.verify), headless=True, args=self.__browser_args)
 
         return self._browser
 
+    @property
+    def render_semaphore(self) -> asyncio.Semaphore:
+        """ Limits how many pages ``arender`` keeps in flight at once. """
+        if not hasattr(self, "_render_semaphore"):
+            self._render_semaphore = asyncio.Semaphore(self.max_concurrent_renders)
+
+        return self._render_semaphore
+
 
 class HTMLSession(BaseSession):
 
@@ -817,12 +1224,20 @@ class AsyncHTMLSession(BaseSession):
             :param loop: Asyncio loop to use.
             :param workers: Amount of threads to use for executing async calls.
                 If not pass it will default to the number of processors on the
-                machine, multiplied by 5. """
+                machine, plus 4 (at most 32), as for ThreadPoolExecutor. """
         super().__init__(*args, **kwargs)
 
+        if workers is None:
+            workers = min(32, (os.cpu_count() or 1) + 4)
+
         self.loop = loop or asyncio.get_event_loop()
         self.thread_pool = ThreadPoolExecutor(max_workers=workers)
 
+        # Keep a pooled connection per worker thread. With requests' default
+        # of 10 per host, busier pools throw connections away and reconnect.
+        for prefix in ('https://', 'http://'):
+            self.mount(prefix, HTTPAdapter(pool_maxsize=workers))
+
     def request(self, *args, **kwargs):
         """ Partial original request func and run it in a thread. """
         func = partial(super().request, *args, **kwargs)
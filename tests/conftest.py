@@ -0,0 +1,12 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def event_loop():
+    """One loop per test module, rather than one per async test, so that
+    the async tests of a module can also share sessions bound to it."""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
@@ -1,4 +1,8 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
+import pytest_asyncio
 from requests_html import HTMLSession, AsyncHTMLSession, HTMLResponse
 
 
@@ -13,31 +17,67 @@ urls = [
 ]
 
 
+@pytest.fixture(scope='module')
+def pages():
+    """Starts fetching all the urls at once, so the tests only wait for the
+    slowest site rather than for every site in turn."""
+    session = HTMLSession()
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        yield {url: executor.submit(session.get, url) for url in urls}
+    session.close()
+
+
 @pytest.mark.parametrize('url', urls)
 @pytest.mark.internet
-def test_pagination(url: str):
-    session = HTMLSession()
-    r = session.get(url)
+def test_pagination(url: str, pages):
+    r = pages[url].result()
     assert next(r.html)
 
 
+@pytest.fixture(scope='module')
+def asession(event_loop):
+    session = AsyncHTMLSession(loop=event_loop)
+    yield session
+    event_loop.run_until_complete(session.close())
+
+
+@pytest_asyncio.fixture(scope='module')
+async def async_pages(asession):
+    """Fetches all the urls at once on the shared session. A failed fetch
+    is kept, to be raised by the test of its url only."""
+    responses = await asyncio.gather(*(asession.get(url) for url in urls), return_exceptions=True)
+    return dict(zip(urls, responses))
+
+
 @pytest.mark.parametrize('url', urls)
 @pytest.mark.internet
 @pytest.mark.asyncio
-async def test_async_pagination(event_loop, url):
-    asession = AsyncHTMLSession()
-
-    r = await asession.get(url)
+async def test_async_pagination(async_pages, url):
+    r = async_pages[url]
+    if isinstance(r, Exception):
+        raise r
     assert await r.html.__anext__()
 
 
 @pytest.mark.internet
-def test_async_run():
-    asession = AsyncHTMLSession()
+@pytest.mark.asyncio
+async def test_async_iter_pages(asession):
+    r = await asession.get(urls[0])
+    pages = []
+    async for page in r.html.aiter():
+        pages.append(page)
+        if len(pages) == 3:
+            break
 
+    assert len(pages) == 3
+    assert len({page.url for page in pages}) == 3
+
+
+@pytest.mark.internet
+def test_async_run(asession):
     async_list = []
     for url in urls:
-        async def _test():
+        async def _test(url=url):
             return await asession.get(url)
         async_list.append(_test)
 
@@ -1,37 +1,70 @@
-import os
+import asyncio
 from functools import partial
+from pathlib import Path
 
 import pytest
 from pyppeteer.browser import Browser
 from pyppeteer.page import Page
-from requests_html import HTMLSession, AsyncHTMLSession, HTML
+from requests_html import HTMLSession, AsyncHTMLSession, HTML, MaxRetries, clear_parse_cache
 from requests_file import FileAdapter
+from lxml import etree
+from lxml.cssselect import CSSSelector
+
+# FileAdapter keeps no state, so one instance serves every session.
+file_adapter = FileAdapter()
 
 session = HTMLSession()
-session.mount('file://', FileAdapter())
+session.mount('file://', file_adapter)
+
+path = Path(__file__).resolve().parent / 'python.html'
+url = path.as_uri()
+python_html = path.read_bytes()
+
+# Evaluated by the render tests, which check that its result is returned.
+dimensions_script = """
+() => {
+    return {
+        width: document.documentElement.clientWidth,
+        height: document.documentElement.clientHeight,
+        deviceScaleFactor: window.devicePixelRatio,
+    }
+}
+"""
 
 
 def get():
-    path = os.path.sep.join((os.path.dirname(os.path.abspath(__file__)), 'python.html'))
-    url = f'file://{path}'
-
     return session.get(url)
 
 
-@pytest.fixture
-def async_get(event_loop):
+@pytest.fixture(scope='module')
+def r():
+    """python.html, fetched and parsed once for the tests that only read it."""
+    return get()
+
+
+@pytest.fixture(scope='module')
+def about(r):
+    """The #about element of python.html, found once for the tests that read it."""
+    return r.html.find('#about', first=True)
+
+
+@pytest.fixture(scope='module')
+def async_session(event_loop):
     """AsyncSession cannot be created global since it will create
-        a different loop from pytest-asyncio. """
-    async_session = AsyncHTMLSession()
-    async_session.mount('file://', FileAdapter())
-    path = os.path.sep.join((os.path.dirname(os.path.abspath(__file__)), 'python.html'))
-    url = 'file://{}'.format(path)
+        a different loop from pytest-asyncio, so it is bound to the
+        module's loop instead. """
+    async_session = AsyncHTMLSession(loop=event_loop)
+    async_session.mount('file://', file_adapter)
+    yield async_session
+    event_loop.run_until_complete(async_session.close())
+
 
+@pytest.fixture
+def async_get(async_session):
     return partial(async_session.get, url)
 
 
-def test_file_get():
-    r = get()
+def test_file_get(r):
     assert r.status_code == 200
 
 
@@ -41,29 +74,28 @@ async def test_async_file_get(async_get):
     assert r.status_code == 200
 
 
-def test_class_seperation():
-    r = get()
-
-    about = r.html.find('#about', first=True)
+def test_class_seperation(about):
     assert len(about.attrs['class']) == 2
 
 
-def test_css_selector():
-    r = get()
-
-    about = r.html.find('#about', first=True)
+def test_css_selector(about):
+    text_lines = set(about.text.split('\n'))
+    full_text_lines = set(about.full_text.split('\n'))
 
     for menu_item in (
             'About', 'Applications', 'Quotes', 'Getting Started', 'Help',
             'Python Brochure'
     ):
-        assert menu_item in about.text.split('\n')
-        assert menu_item in about.full_text.split('\n')
+        assert menu_item in text_lines
+        assert menu_item in full_text_lines
 
 
-def test_containing():
-    r = get()
+def test_compiled_css_selector(r, about):
+    # Precompiled selectors are used as they are.
+    assert r.html.find(CSSSelector('#about'), first=True).element is about.element
+
 
+def test_containing(r):
     python = r.html.find(containing='python')
     assert len(python) == 192
 
@@ -71,18 +103,24 @@ def test_containing():
         assert 'python' in e.full_text.lower()
 
 
-def test_attrs():
-    r = get()
-    about = r.html.find('#about', first=True)
+def test_containing_ignores_case():
+    html = HTML(html='<p>ÜBER uns</p><p>Python</p>')
+
+    assert [p.text for p in html.find('p', containing='über')] == ['ÜBER uns']
+    assert [p.text for p in html.find('p', containing=['PYTHON', 'nothing'])] == ['Python']
 
+
+def test_attrs(about):
     assert 'aria-haspopup' in about.attrs
     assert len(about.attrs['class']) == 2
 
+    # attrs is a plain dictionary, which callers may update.
+    a = HTML(html='<a href="/" rel="next nofollow">').find('a', first=True)
+    a.attrs['href'] = '/other'
+    assert a.attrs == {'href': '/other', 'rel': ('next', 'nofollow')}
 
-def test_links():
-    r = get()
-    about = r.html.find('#about', first=True)
 
+def test_links(about):
     assert len(about.links) == 6
     assert len(about.absolute_links) == 6
 
@@ -96,20 +134,37 @@ async def test_async_links(async_get):
     assert len(about.absolute_links) == 6
 
 
-def test_search():
-    r = get()
+def test_search(r):
     style = r.html.search('Python is a {} language')[0]
     assert style == 'programming'
 
 
-def test_xpath():
-    r = get()
+def test_xpath(r):
     html = r.html.xpath('/html', first=True)
     assert 'no-js' in html.attrs['class']
 
     a_hrefs = r.html.xpath('//a/@href')
     assert '#site-map' in a_hrefs
 
+    # Precompiled expressions are used as they are.
+    assert r.html.xpath(etree.XPath('//a/@href')) == a_hrefs
+
+
+def test_clean():
+    doc = """<div><p class="intro" data-id="1" style="color: red">Hello<script>alert(1)</script></p></div>"""
+    html = HTML(html=doc)
+
+    for p in (html.find('p', clean=True, first=True), html.xpath('//p', clean=True, first=True)):
+        assert 'script' not in p.html
+        assert p.text == 'Hello'
+
+        # Attributes and position come from the element in the document.
+        assert p.attrs == {'class': ('intro',), 'data-id': '1', 'style': 'color: red'}
+        assert p.element.getparent().tag == 'div'
+
+    # The document itself is left untouched.
+    assert html.find('script', first=True)
+
 
 def test_html_loading():
     doc = """<a href='https://httpbin.org'>"""
@@ -121,10 +176,52 @@ def test_html_loading():
 
 
 def test_anchor_links():
-    r = get()
-    r.html.skip_anchors = False
+    html = HTML(html=python_html, url=url)
+    html.skip_anchors = False
+
+    assert '#site-map' in html.links
+
+
+@pytest.mark.parametrize('doc,next_symbol,expected', [
+    # The last candidate that looks like a next link: by rel, class or href.
+    ("""<a href="/a">more</a> <a href="/b" class="next-btn">Next</a>
+        <a href="/c" rel="next">next page</a> <a href="/d">older</a>""", None, 'http://example.com/c'),
+    # Else the first candidate.
+    ("""<a href="/a">previous</a> <a href="/b">more</a> <a href="/c">older</a>""", None, 'http://example.com/b'),
+    # Symbols match whatever the case, for any letters.
+    ("""<a href="/a">NÄCHSTE</a> <a href="/b">Следующая</a>""", ['nächste'], 'http://example.com/a'),
+    ("""<a href="/a">NÄCHSTE</a> <a href="/b">Следующая</a>""", ['следующая'], 'http://example.com/b'),
+    ("""<a href="/a">previous</a>""", None, None),
+])
+def test_next(doc, next_symbol, expected):
+    html = HTML(html=doc, url='http://example.com/list')
+    assert html.next(next_symbol=next_symbol) == expected
+
 
-    assert '#site-map' in r.html.links
+@pytest.fixture
+def pages(tmp_path):
+    """Three pages on disk, each linking to the next one."""
+    for i in (1, 2, 3):
+        link = f'<a href="page{i + 1}.html">next</a>' if i < 3 else ''
+        (tmp_path / f'page{i}.html').write_text(f'<p>Page {i}</p>{link}')
+
+    return (tmp_path / 'page1.html').as_uri()
+
+
+async def aiter_texts(html):
+    return [page.find('p', first=True).text async for page in html.aiter()]
+
+
+@pytest.mark.asyncio
+async def test_aiter(pages):
+    r = session.get(pages)
+    assert await aiter_texts(r.html) == ['Page 1', 'Page 2', 'Page 3']
+
+
+@pytest.mark.asyncio
+async def test_async_aiter(async_session, pages):
+    r = await async_session.get(pages)
+    assert await aiter_texts(r.html) == ['Page 1', 'Page 2', 'Page 3']
 
 
 @pytest.mark.parametrize('url,link,expected', [
@@ -159,19 +256,59 @@ def test_parser():
     assert html.element('a').text().strip() == 'httpbin.org'
 
 
+@pytest.mark.parametrize('doc,tags,expected', [
+    ('<p>a</p><p>b</p>', ['html', 'p', 'p'], '<html><p>a</p><p>b</p></html>'),
+    ('hi <b>x</b>', ['html', 'b'], '<html>hi <b>x</b></html>'),
+    ('<body><p>a</p></body>', ['html', 'body', 'p'], '<html><body><p>a</p></body></html>'),
+])
+def test_parse_fragments(doc, tags, expected):
+    html = HTML(html=doc)
+
+    # Fragments go straight under <html>, without a wrapper of their own.
+    assert [e.tag for e in html.find('*')] == tags
+    assert html.find('html', first=True).html == expected
+
+
+def test_parse_element():
+    body = HTML(html='<html><body><p>a</p></body></html>').find('body', first=True)
+
+    # Elements are parsed again as they are.
+    assert [e.tag for e in body.find('*')] == ['html', 'body', 'p']
+    assert [e.tag for e in body.find('body')] == ['body']
+
+
+def test_parse_element_without_tail():
+    html = HTML(html='<p>Use <a>Django</a>, <a>Flask</a> and more.</p>')
+
+    # The text after an element belongs to its parent, not to it.
+    assert [a.text for a in html.find('a')] == ['Django', 'Flask']
+    assert [a.full_text for a in html.find('a')] == ['Django', 'Flask']
+
+
+def test_parse_whitespace():
+    doc = """<div>\n   <pre>  a\n  <b> x </b>  \n</pre>   <p>b</p>\t<!-- c -->  </div>"""
+
+    # Whitespace-only text is collapsed, as BeautifulSoup does, but in <pre>.
+    for html in (HTML(html=doc), HTML(html=doc, parse_cache=True)):
+        assert html.find('div', first=True).html == '<div>\n<pre>  a\n  <b> x </b>  \n</pre> <p>b</p> <!-- c --> </div>'
+
+
+def test_parse_cache():
+    doc = """<a href='https://httpbin.org'>"""
+
+    first = HTML(html=doc, parse_cache=True)
+    second = HTML(html=doc, parse_cache=True)
+    assert first.element[0] is second.element[0]
+    assert HTML(html=doc).element[0] is not first.element[0]
+
+    clear_parse_cache()
+    assert HTML(html=doc, parse_cache=True).element[0] is not first.element[0]
+
+
 @pytest.mark.render
 def test_render():
     r = get()
-    script = """
-    () => {
-        return {
-            width: document.documentElement.clientWidth,
-            height: document.documentElement.clientHeight,
-            deviceScaleFactor: window.devicePixelRatio,
-        }
-    }
-    """
-    val = r.html.render(script=script)
+    val = r.html.render(script=dimensions_script)
     for value in ('width', 'height', 'deviceScaleFactor'):
         assert value in val
 
@@ -183,38 +320,19 @@ def test_render():
 @pytest.mark.asyncio
 async def test_async_render(async_get):
     r = await async_get()
-    script = """
-    () => {
-        return {
-            width: document.documentElement.clientWidth,
-            height: document.documentElement.clientHeight,
-            deviceScaleFactor: window.devicePixelRatio,
-        }
-    }
-    """
-    val = await r.html.arender(script=script)
+    val = await r.html.arender(script=dimensions_script)
     for value in ('width', 'height', 'deviceScaleFactor'):
         assert value in val
 
     about = r.html.find('#about', first=True)
     assert len(about.links) == 6
-    await r.html.browser.close()
 
 
 @pytest.mark.render
 def test_bare_render():
     doc = """<a href='https://httpbin.org'>"""
-    html = HTML(html=doc)
-    script = """
-        () => {
-            return {
-                width: document.documentElement.clientWidth,
-                height: document.documentElement.clientHeight,
-                deviceScaleFactor: window.devicePixelRatio,
-            }
-        }
-    """
-    val = html.render(script=script, reload=False)
+    html = HTML(html=doc, session=session)
+    val = html.render(script=dimensions_script, reload=False)
     for value in ('width', 'height', 'deviceScaleFactor'):
         assert value in val
 
@@ -227,16 +345,7 @@ def test_bare_render():
 async def test_bare_arender():
     doc = """<a href='https://httpbin.org'>"""
     html = HTML(html=doc, async_=True)
-    script = """
-        () => {
-            return {
-                width: document.documentElement.clientWidth,
-                height: document.documentElement.clientHeight,
-                deviceScaleFactor: window.devicePixelRatio,
-            }
-        }
-    """
-    val = await html.arender(script=script, reload=False)
+    val = await html.arender(script=dimensions_script, reload=False)
     for value in ('width', 'height', 'deviceScaleFactor'):
         assert value in val
 
@@ -260,7 +369,7 @@ def test_bare_js_eval():
     </html>
     """
 
-    html = HTML(html=doc)
+    html = HTML(html=doc, session=session)
     html.render()
 
     assert html.find('#replace', first=True).text == 'yolo'
@@ -289,6 +398,76 @@ async def test_bare_js_async_eval():
     await html.browser.close()
 
 
+class FakePage:
+    closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+def fake_render(monkeypatch, *outcomes):
+    """Replaces HTML._async_render, each call waiting for the given delay and
+    then returning (or raising) the next of ``outcomes``."""
+    calls = []
+
+    async def _async_render(self, **kwargs):
+        delay, outcome = outcomes[len(calls)]
+        calls.append(kwargs)
+        await asyncio.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(HTML, '_async_render', _async_render)
+    return calls
+
+
+def bare_async_html():
+    session = AsyncHTMLSession()
+    session._browser = None
+    return HTML(html='<p>original</p>', session=session)
+
+
+@pytest.mark.asyncio
+async def test_arender_renders_once(monkeypatch):
+    calls = fake_render(monkeypatch, (0, ('<p>rendered</p>', 'result', None)))
+    html = bare_async_html()
+
+    assert await html.arender() == 'result'
+    assert len(calls) == 1
+    assert html.find('p', first=True).text == 'rendered'
+
+
+@pytest.mark.asyncio
+async def test_arender_retries_timeouts(monkeypatch):
+    calls = fake_render(monkeypatch, (0, None), (0, None), (0, ('<p>rendered</p>', 'result', None)))
+    assert await bare_async_html().arender() == 'result'
+    assert len(calls) == 3
+
+    calls = fake_render(monkeypatch, (0, None), (0, None))
+    with pytest.raises(MaxRetries):
+        await bare_async_html().arender(retries=2)
+    assert len(calls) == 2
+
+    calls = fake_render(monkeypatch, (0, ValueError()))
+    with pytest.raises(ValueError):
+        await bare_async_html().arender()
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_arender_hedges_overdue_render(monkeypatch):
+    page = FakePage()
+    calls = fake_render(monkeypatch, (0.2, ('<p>rendered</p>', 'result', page)), (0, ValueError()))
+    html = bare_async_html()
+
+    # The first attempt runs past its timeout, so a second one is started;
+    # that one fails, but the first still wins.
+    assert await html.arender(wait=0, timeout=0.05, keep_page=True) == 'result'
+    assert len(calls) == 2
+    assert html.page is page and not page.closed
+
+
 def test_browser_session():
     """ Test browser instances is created and properly close when session is closed.
         Note: session.close method need to be tested together with browser creation,
@@ -301,8 +480,8 @@ def test_browser_session():
 
 
 def test_browser_process():
+    r = get()
     for _ in range(3):
-        r = get()
         r.html.render()
 
         assert r.html.page is None